@@ -1,17 +1,68 @@
+import asyncio
+import hashlib
+import io
 import json
+import logging
 import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 # Import bedrock_agentcore directly instead of using MemoryClient
 import boto3
+import httpx
+import ijson
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from datetime import datetime, timezone
-from urllib.parse import urlparse
+from urllib.parse import quote
+
+# Lambda ships every stdout line to CloudWatch synchronously; keep the hot
+# path down to one structured INFO line and gate the verbose output on DEBUG
+logger = logging.getLogger()
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO"))
 
 REGION = os.getenv("AWS_REGION", "us-east-1")
 MEMORY_ID = os.environ["AGENTCORE_MEMORY_ID"]
 MODEL_ID = os.environ["MY_BEDROCK_MODEL_ID"]
+# Optional bucket for caching extraction results; cache is skipped when unset
+CACHE_BUCKET = os.getenv("LLM_CACHE_BUCKET")
+# Optional DynamoDB table for the faster per-session cache tier; skipped when unset
+CACHE_TABLE = os.getenv("LLM_CACHE_TABLE")
+
+# Keep TCP connections alive across warm invocations and back off adaptively
+_BOTO_CONFIG = Config(
+    tcp_keepalive=True,
+    max_pool_connections=50,
+    retries={"mode": "adaptive"},
+)
+
+s3 = boto3.client("s3", region_name=REGION, config=_BOTO_CONFIG)
+agentcore = boto3.client("bedrock-agentcore", region_name=REGION, config=_BOTO_CONFIG)
+ddb = boto3.client("dynamodb", region_name=REGION, config=_BOTO_CONFIG)
 
-s3 = boto3.client("s3", region_name=REGION)
-bedrock = boto3.client("bedrock-runtime", region_name=REGION)
-agentcore = boto3.client("bedrock-agentcore", region_name=REGION)
+# Bedrock is called over raw HTTPS with manual SigV4 signing so multiple SNS
+# records can invoke the model concurrently. The client is module-global so
+# warm containers reuse the TLS connection pool.
+BEDROCK_INVOKE_URL = (
+    f"https://bedrock-runtime.{REGION}.amazonaws.com"
+    f"/model/{quote(MODEL_ID, safe='')}/invoke"
+)
+_credentials = boto3.Session().get_credentials()
+_http = httpx.AsyncClient(timeout=60.0)
+
+# One persistent loop per container: asyncio.run would close its loop after
+# every invoke, leaving the client's pooled connections bound to a dead loop
+# and crashing the next warm invocation
+_LOOP = asyncio.new_event_loop()
+
+# Touching endpoint_url here forces endpoint resolution into the Init phase
+# (billed, but off the first invoke's critical path); the credential fetch
+# above does the same for the SigV4 signer
+_ = s3.meta.endpoint_url
+_ = agentcore.meta.endpoint_url
+_ = ddb.meta.endpoint_url
 
 EXTRACTION_SYSTEM = """You extract durable user memory for an assistant.
 Return ONLY valid JSON:
@@ -23,53 +74,266 @@ Rules:
 - Prefer stable long-lived facts (name, preferred contact method, etc).
 """
 
+# Bump when EXTRACTION_SYSTEM changes so stale cached extractions are not reused
+EXTRACTION_PROMPT_VERSION = "v1"
+
+# Transcripts shorter than this can't contain a durable fact; skip the invoke
+MIN_TRANSCRIPT_CHARS = 32
+
+# Shared by every record; boto3 serializes by value so one list is safe
+# (per-actor variant would be [f"/users/{actor_id}/info", "/"])
+_NS = ["/"]
+
+# Precomputed once per container instead of rebuilt on every invoke
+PROMPT_PREFIX = f"{EXTRACTION_SYSTEM}\n\nText:\n"
+_BODY_BASE = {
+    "anthropic_version": "bedrock-2023-05-31",
+    "max_tokens": 300,
+}
+
+def _cache_key(transcript: str) -> str:
+    """Content hash of everything that determines the extraction result."""
+    h = hashlib.sha256()
+    for part in (MODEL_ID, EXTRACTION_PROMPT_VERSION, transcript):
+        data = part.encode("utf-8")
+        h.update(len(data).to_bytes(8, "big"))
+        h.update(data)
+    return h.hexdigest()
+
+def _cache_get(key: str) -> dict | None:
+    if not CACHE_BUCKET:
+        return None
+    s3_key = f"llm-cache/{key}.json"
+    # The cache is an optional tier: any unexpected S3 failure (misconfigured
+    # bucket, AccessDenied, throttling) degrades to a miss instead of failing
+    # the event
+    try:
+        obj = s3.get_object(Bucket=CACHE_BUCKET, Key=s3_key)
+    except s3.exceptions.NoSuchKey:
+        return None
+    except ClientError as e:
+        logger.warning("S3 cache read failed, treating as miss: %s", e)
+        return None
+    try:
+        cached = json.loads(obj["Body"].read())
+    except ValueError:
+        cached = None
+    if not isinstance(cached, dict) or not isinstance(cached.get("facts"), list):
+        # Corrupt or schema-drifted entry: evict so the next miss rewrites it
+        try:
+            s3.delete_object(Bucket=CACHE_BUCKET, Key=s3_key)
+        except ClientError as e:
+            logger.warning("S3 cache eviction failed: %s", e)
+        return None
+    return cached
+
+def _cache_put(key: str, extracted: dict) -> None:
+    if not CACHE_BUCKET:
+        return
+    # Best-effort: the Bedrock call already succeeded, so a failed cache write
+    # must not fail the event
+    try:
+        s3.put_object(
+            Bucket=CACHE_BUCKET,
+            Key=f"llm-cache/{key}.json",
+            Body=json.dumps(extracted),
+            ContentType="application/json",
+            Metadata={
+                "modelid": MODEL_ID,
+                "ts": datetime.now(timezone.utc).isoformat(),
+            },
+        )
+    except ClientError as e:
+        logger.warning("S3 cache write failed: %s", e)
+
+# SNS delivers at-least-once, so replays of the same session/transcript are
+# common; DynamoDB answers those in single-digit ms vs ~30 ms for S3
+_DDB_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+def _ddb_cache_get(session_id: str | None, key: str) -> dict | None:
+    if not CACHE_TABLE or not session_id:
+        return None
+    # Fail open like the S3 tier: a missing/misconfigured table must degrade
+    # to a miss, not take down the pipeline
+    try:
+        resp = ddb.get_item(
+            TableName=CACHE_TABLE,
+            Key={"pk": {"S": session_id}, "sk": {"S": key}},
+            ConsistentRead=False,
+        )
+    except ClientError as e:
+        logger.warning("DynamoDB cache read failed, treating as miss: %s", e)
+        return None
+    item = resp.get("Item")
+    if not item:
+        return None
+    try:
+        cached = json.loads(item["facts"]["S"])
+    except (KeyError, ValueError):
+        return None
+    if not isinstance(cached, dict) or not isinstance(cached.get("facts"), list):
+        return None
+    return cached
+
+def _ddb_cache_put(session_id: str | None, key: str, extracted: dict) -> None:
+    if not CACHE_TABLE or not session_id:
+        return
+    try:
+        ddb.put_item(
+            TableName=CACHE_TABLE,
+            Item={
+                "pk": {"S": session_id},
+                "sk": {"S": key},
+                "facts": {"S": json.dumps(extracted)},
+                "ttl": {"N": str(int(time.time()) + _DDB_CACHE_TTL_SECONDS)},
+            },
+        )
+    except ClientError as e:
+        logger.warning("DynamoDB cache write failed: %s", e)
+
 def _parse_s3_payload_location(s3_payload_location: str) -> tuple[str, str]:
-    u = urlparse(s3_payload_location)
-    if u.scheme != "s3" or not u.netloc or not u.path:
+    # The location is always s3://bucket/key, so str.partition beats a full
+    # urlparse on this per-invocation path
+    if not s3_payload_location.startswith("s3://"):
+        raise ValueError(f"Unexpected s3PayloadLocation: {s3_payload_location}")
+    bucket, _, key = s3_payload_location[5:].partition("/")
+    if not bucket or not key:
         raise ValueError(f"Unexpected s3PayloadLocation: {s3_payload_location}")
-    return u.netloc, u.path.lstrip("/")
+    return bucket, key
+
+# One compact encoder shared by every fallback serialization in the loop
+_enc = json.JSONEncoder(separators=(",", ":")).encode
 
-def _extract_text_from_context_item(item: dict) -> str:
+def _extract_text_from_context_item(item: dict) -> tuple[str, str]:
     role = item.get("role", "UNKNOWN")
     content = item.get("content", {})
     text = content.get("text")
     if text is None:
-        text = json.dumps(content) if content else json.dumps(item)
-    return f"{role}: {text}"
-
-def _build_transcript(payload: dict) -> str:
-    parts = []
-    for section in ("historicalContext", "currentContext"):
-        for item in payload.get(section, []) or []:
-            if "role" in item and "content" in item:
-                parts.append(_extract_text_from_context_item(item))
-    return "\n".join(parts)
-
-def invoke_model(text: str) -> dict:
-    body = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 300,
-        "messages": [
-            {
-                "role": "user",
-                "content": f"{EXTRACTION_SYSTEM}\n\nText:\n{text}",
-            }
-        ],
-    }
-
-    resp = bedrock.invoke_model(
-        modelId=MODEL_ID,
-        body=json.dumps(body),
+        text = _enc(content) if content else _enc(item)
+    return role, text
+
+# Streaming-parse prefixes for the two context arrays in the delivered payload
+_CONTEXT_ITEM_PREFIXES = ("historicalContext.item", "currentContext.item")
+
+def _build_transcript(stream) -> tuple[str, str, str]:
+    """Parse the delivered payload incrementally from a StreamingBody.
+
+    Only one context item is materialized at a time, so peak memory stays
+    O(largest item) rather than O(payload). Returns (actor_id, session_id,
+    transcript).
+    """
+    actor_id = None
+    session_id = None
+    # Items are written straight into a StringIO; no per-item "role: text"
+    # intermediate strings
+    buf = io.StringIO()
+    builder = None
+    # The historical window re-sends earlier turns, so identical (role, text)
+    # items show up in both sections; dedupe them to keep prompt tokens down
+    seen = set()
+    # Bound locals: this loop runs once per parse event across every context item
+    write = buf.write
+    extract = _extract_text_from_context_item
+    blake2b = hashlib.blake2b
+    for prefix, event, value in ijson.parse(stream):
+        if builder is not None:
+            builder.event(event, value)
+            if event == "end_map" and prefix in _CONTEXT_ITEM_PREFIXES:
+                item = builder.value
+                builder = None
+                if "role" in item and "content" in item:
+                    role, text = extract(item)
+                    h = blake2b(f"{role}\x00{text}".encode(), digest_size=16).digest()
+                    if h in seen:
+                        continue
+                    seen.add(h)
+                    if buf.tell():
+                        write("\n")
+                    write(role)
+                    write(": ")
+                    write(text)
+        elif event == "start_map" and prefix in _CONTEXT_ITEM_PREFIXES:
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+        elif prefix == "actorId":
+            actor_id = value
+        elif prefix == "sessionId":
+            session_id = value
+    return actor_id, session_id, buf.getvalue()
+
+# Signing manually means boto3's retry layer is gone; back off on throttling
+# and server errors ourselves
+_INVOKE_RETRIES = 3
+
+async def invoke_model(text: str) -> dict:
+    body = json.dumps({
+        **_BODY_BASE,
+        "messages": [{"role": "user", "content": PROMPT_PREFIX + text}],
+    })
+
+    request = AWSRequest(
+        method="POST",
+        url=BEDROCK_INVOKE_URL,
+        data=body,
+        headers={"Content-Type": "application/json"},
     )
+    SigV4Auth(_credentials, "bedrock", REGION).add_auth(request)
+
+    for attempt in range(_INVOKE_RETRIES):
+        resp = await _http.post(
+            BEDROCK_INVOKE_URL,
+            headers=dict(request.headers),
+            content=body,
+        )
+        retryable = resp.status_code == 429 or resp.status_code >= 500
+        if not retryable or attempt == _INVOKE_RETRIES - 1:
+            break
+        await asyncio.sleep((2 ** attempt) * 0.5 + random.uniform(0, 0.25))
+    resp.raise_for_status()
 
-    result = json.loads(resp["body"].read())
-    content_text = result["content"][0]["text"]
+    # Only content[0].text matters; pull it off the response without
+    # materializing the rest of the envelope. A bare next() here would turn an
+    # empty content array into "coroutine raised StopIteration".
+    content_text = next(ijson.items(io.BytesIO(resp.content), "content.item.text"), None)
+    if content_text is None:
+        raise ValueError("no text block in Bedrock response")
     return json.loads(content_text)
 
-def handler(event, context):
+# batch_create_memory_records caps records per call; writes are network-bound,
+# so chunks go out concurrently
+_BATCH_SIZE = 25
+_BATCH_WORKERS = 8
+_BATCH_RETRIES = 5
+
+def _put_record_chunk(chunk: list[dict]) -> None:
+    for attempt in range(_BATCH_RETRIES):
+        try:
+            agentcore.batch_create_memory_records(
+                memoryId=MEMORY_ID,
+                records=chunk,
+            )
+            return
+        except agentcore.exceptions.ClientError as e:
+            code = e.response.get("Error", {}).get("Code", "")
+            if code != "ThrottlingException" or attempt == _BATCH_RETRIES - 1:
+                raise
+            time.sleep((2 ** attempt) * 0.1 + random.uniform(0, 0.1))
+
+def _store_records(records: list[dict]) -> None:
+    chunks = [
+        records[i:i + _BATCH_SIZE]
+        for i in range(0, len(records), _BATCH_SIZE)
+    ]
+    if len(chunks) == 1:
+        _put_record_chunk(chunks[0])
+        return
+    with ThreadPoolExecutor(max_workers=_BATCH_WORKERS) as ex:
+        list(ex.map(_put_record_chunk, chunks))
+
+async def _process_record(record: dict) -> int:
     # 1) SNS -> Lambda
-    sns_msg_raw = event["Records"][0]["Sns"]["Message"]
-    print("SNS message raw:", sns_msg_raw)
+    sns_msg_raw = record["Sns"]["Message"]
+    logger.debug("SNS message raw: %s", sns_msg_raw)
 
     msg = json.loads(sns_msg_raw)
 
@@ -77,47 +341,75 @@ def handler(event, context):
     s3_payload_location = msg["s3PayloadLocation"]
     bucket, key = _parse_s3_payload_location(s3_payload_location)
 
-    # 3) Download payload JSON
+    # 3) Stream payload JSON straight off the S3 response body
     obj = s3.get_object(Bucket=bucket, Key=key)
-    delivered = json.loads(obj["Body"].read())
-
-    actor_id = delivered.get("actorId")
-    session_id = delivered.get("sessionId")
+    actor_id, session_id, transcript = _build_transcript(obj["Body"])
+    logger.debug("Transcript: %s", transcript)
 
-    transcript = _build_transcript(delivered)
-    print(f"Transcript: {transcript}")
+    # No usable context items means the model call would be a guaranteed no-op
+    if len(transcript) < MIN_TRANSCRIPT_CHARS:
+        logger.info(json.dumps({
+            "event": "skipped",
+            "reason": "empty_transcript",
+            "actor": actor_id,
+            "session": session_id,
+        }))
+        return 0
     
-    extracted = invoke_model(transcript)
-    print(f"Extracted facts: {extracted}")
+    # Extraction is deterministic per (model, prompt, transcript), so check the
+    # cache before paying for a Bedrock round-trip
+    cache_key = _cache_key(transcript)
+    extracted = _ddb_cache_get(session_id, cache_key)
+    if extracted is None:
+        extracted = _cache_get(cache_key)
+        if extracted is not None:
+            _ddb_cache_put(session_id, cache_key, extracted)
+    cache_hit = extracted is not None
+    if not cache_hit:
+        extracted = await invoke_model(transcript)
+        _cache_put(cache_key, extracted)
+        _ddb_cache_put(session_id, cache_key, extracted)
+    logger.debug("Extracted facts: %s", extracted)
 
-    now = datetime.now(timezone.utc).isoformat()
+    # Second precision is plenty for record timestamps and keeps the batch
+    # write payload smaller
+    now = datetime.now(timezone.utc).isoformat(timespec="seconds")
 
-    records = []
-    for f in extracted.get("facts", []):
-        print(f"Processing fact: {f}")
-        records.append({
+    records = [
+        {
             "requestIdentifier": f"{session_id}-{f.get('key', 'unknown')}",
-            # "namespaces": [f"/users/{actor_id}/info", "/"],
-            "namespaces": ["/"],
+            "namespaces": _NS,
             "content": {"text": f'{f["key"]}: {f["value"]}'},
             "timestamp": now,
-        })
+        }
+        for f in extracted.get("facts", [])
+    ]
     
-    print(f"Created {len(records)} records for actor_id: {actor_id}, session_id: {session_id}")
-
     # Store memories using boto3 bedrock-agentcore client
     if records:
         try:
-            print(f"Attempting to store {len(records)} records to memory {MEMORY_ID}")
-            response = agentcore.batch_create_memory_records(
-                memoryId=MEMORY_ID,
-                records=records,
-            )
-            print(f"Successfully stored records. Response: {response}")
+            _store_records(records)
         except Exception as e:
-            print(f"Error storing records: {str(e)}")
+            logger.error("Error storing records: %s", e)
             raise e
-    else:
-        print("No records to store")
 
-    return {"ok": True, "stored": len(records)}
+    # One structured line per record instead of a print per step
+    logger.info(json.dumps({
+        "event": "processed",
+        "actor": actor_id,
+        "session": session_id,
+        "cache_hit": cache_hit,
+        "n_records": len(records),
+    }))
+
+    return len(records)
+
+async def _process_event(event: dict) -> list[int]:
+    # Model invocations for all records in the batch run concurrently
+    return await asyncio.gather(
+        *(_process_record(record) for record in event["Records"])
+    )
+
+def handler(event, context):
+    stored = _LOOP.run_until_complete(_process_event(event))
+    return {"ok": True, "stored": sum(stored)}
@@ -6,10 +6,9 @@ import os
 import sys
 import boto3
 import zipfile
-import io
+import shutil
 import subprocess
 import tempfile
-import time
 
 REGION = os.getenv("AWS_REGION", "us-east-1")
 STACK_NAME = "userinfoagent-memory-infrastructure-02"
@@ -20,39 +19,69 @@ def update_lambda_code(memory_id=None):
         # Get Lambda function name from CloudFormation
         cf = boto3.client("cloudformation", region_name=REGION)
         lambda_client = boto3.client("lambda", region_name=REGION)
-        
+        s3 = boto3.client("s3", region_name=REGION)
+
         # Get stack outputs
         response = cf.describe_stacks(StackName=STACK_NAME)
         outputs = response['Stacks'][0]['Outputs']
-        
-        # Find Lambda function ARN
+
+        # Find Lambda function ARN and the bucket used to stage the zip
         lambda_arn = None
+        deploy_bucket = None
         for output in outputs:
             if output['OutputKey'] == 'LambdaFunctionArn':
                 lambda_arn = output['OutputValue']
-                break
-        
+            elif output['OutputKey'] == 'MemoryEventsBucket':
+                deploy_bucket = output['OutputValue']
+
         if not lambda_arn:
             print("Error: Could not find Lambda function ARN in stack outputs")
             return False
-        
+
+        if not deploy_bucket:
+            print("Error: Could not find MemoryEventsBucket in stack outputs")
+            return False
+
         function_name = lambda_arn.split(':')[-1]
         
         # Create temporary directory for building package
         with tempfile.TemporaryDirectory() as temp_dir:
             print("Installing dependencies for Lambda Python 3.11...")
             
-            # Install only essential packages with correct platform
-            subprocess.run([
-                "pip", "install", 
+            # Install only essential packages with correct platform.
+            # uv resolves and downloads much faster than pip; fall back to pip
+            # when it isn't installed.
+            packages = [
                 "boto3", "botocore", "urllib3",
-                "--target", temp_dir,
-                "--platform", "linux_x86_64",
-                "--implementation", "cp",
-                "--python-version", "3.11",
-                "--only-binary=:all:",
-                "--no-deps"
-            ], check=True)
+                "httpx", "httpcore", "h11", "anyio", "sniffio", "certifi", "idna",
+                # anyio imports typing_extensions unconditionally on Python < 3.13
+                "typing_extensions",
+                "ijson",
+            ]
+            if shutil.which("uv"):
+                install_cmd = [
+                    "uv", "pip", "install",
+                    *packages,
+                    "--target", temp_dir,
+                    "--python-platform", "x86_64-manylinux2014",
+                    "--python-version", "3.11",
+                    # wheels only, like pip's --only-binary=:all: — an sdist
+                    # would build host-platform artifacts into this zip
+                    "--no-build",
+                    "--no-deps"
+                ]
+            else:
+                install_cmd = [
+                    "pip", "install",
+                    *packages,
+                    "--target", temp_dir,
+                    "--platform", "linux_x86_64",
+                    "--implementation", "cp",
+                    "--python-version", "3.11",
+                    "--only-binary=:all:",
+                    "--no-deps"
+                ]
+            subprocess.run(install_cmd, check=True)
             
             # Read lambda function code
             with open('functions/memory_processor/app.py', 'r') as f:
@@ -62,29 +91,50 @@ def update_lambda_code(memory_id=None):
             with open(os.path.join(temp_dir, 'index.py'), 'w') as f:
                 f.write(code_content)
             
-            # Create zip file
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                for root, dirs, files in os.walk(temp_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arc_name = os.path.relpath(file_path, temp_dir)
-                        zip_file.write(file_path, arc_name)
-            
-            zip_buffer.seek(0)
-            
+            # Create zip file on disk so the package size isn't limited by
+            # process memory or the direct-upload API cap
+            zip_fd, zip_path = tempfile.mkstemp(suffix='.zip')
+            os.close(zip_fd)
+            try:
+                # Native extensions and other pre-compressed artifacts barely
+                # deflate; store them as-is and only spend CPU on source files
+                incompressible = ('.so', '.pyd', '.dylib', '.zip', '.whl', '.gz', '.png', '.jpg')
+                with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+                    for root, dirs, files in os.walk(temp_dir):
+                        for file in files:
+                            file_path = os.path.join(root, file)
+                            arc_name = os.path.relpath(file_path, temp_dir)
+                            compress = (
+                                zipfile.ZIP_STORED
+                                if file.endswith(incompressible)
+                                else zipfile.ZIP_DEFLATED
+                            )
+                            zip_file.write(file_path, arc_name, compress_type=compress)
+
+                # Stage the zip in S3 and point Lambda at it
+                deploy_key = f"lambda-deploys/{function_name}.zip"
+                print(f"Uploading package to s3://{deploy_bucket}/{deploy_key}...")
+                s3.upload_file(zip_path, deploy_bucket, deploy_key)
+            finally:
+                os.remove(zip_path)
+
             print(f"Updating Lambda function {function_name}...")
-            
+
             # Update Lambda function code
             lambda_client.update_function_code(
                 FunctionName=function_name,
-                ZipFile=zip_buffer.read()
+                S3Bucket=deploy_bucket,
+                S3Key=deploy_key,
+                Publish=False
             )
             
             # Wait for code update to complete before updating configuration
             if memory_id:
                 print("Waiting for code update to complete...")
-                time.sleep(10)
+                lambda_client.get_waiter('function_updated_v2').wait(
+                    FunctionName=function_name,
+                    WaiterConfig={'Delay': 1, 'MaxAttempts': 30}
+                )
             
             # Update environment variables if memory_id provided
             if memory_id:
@@ -15,14 +15,16 @@ MEMORY_EXEC_ROLE_ARN = os.environ["MEMORY_EXEC_ROLE_ARN"]
 def get_or_create_memory():
     control = boto3.client("bedrock-agentcore-control", region_name=REGION)
     
-    # First, try to find existing memory by ID pattern
+    # First, try to find existing memory by ID pattern. Paginate so a match
+    # beyond the first page is found instead of creating a duplicate memory.
     try:
-        response = control.list_memories()
-        for memory in response.get('memories', []):
-            if memory['id'].startswith('UserInfoSelfManagedMemory-'):
-                # print(memory)
-                memory_id = memory['id']
-                return memory_id
+        paginator = control.get_paginator('list_memories')
+        for page in paginator.paginate(PaginationConfig={'PageSize': 100}):
+            for memory in page.get('memories', []):
+                if memory['id'].startswith('UserInfoSelfManagedMemory-'):
+                    # print(memory)
+                    memory_id = memory['id']
+                    return memory_id
     except Exception as e:
         print(f"Error listing memories: {str(e)}")
     
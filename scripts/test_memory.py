@@ -12,18 +12,19 @@ def test_memory(memory_id):
     client = boto3.client("bedrock-agentcore", region_name=REGION)
     
     # Write test records
+    now = datetime.now(timezone.utc).isoformat(timespec="seconds")
     records = [
         {
             "requestIdentifier": "test-name",
             "namespaces": ["/"],
             "content": {"text": "name: John Doe"},
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "timestamp": now,
         },
         {
-            "requestIdentifier": "test-email", 
+            "requestIdentifier": "test-email",
             "namespaces": ["/"],
             "content": {"text": "email: john@example.com"},
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "timestamp": now,
         }
     ]
     